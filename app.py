@@ -1,15 +1,43 @@
 import streamlit as st
-from llama_index.core import VectorStoreIndex, Document, Settings
+from llama_index.core import VectorStoreIndex, Document, Settings, StorageContext, QueryBundle
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.query_engine import RetrieverQueryEngine
 from llama_index.vector_stores.faiss import FaissVectorStore
-from llama_index.embeddings.gemini import GeminiEmbedding
-from llama_index.llms.groq import Groq
 import faiss
-from docx import Document as DocxDocument
 import pymupdf4llm
+from retrieval import BM25Index, HybridRetriever, EMBED_DIMENSION, RETRIEVAL_MODES, build_document_ids
+from snapshot import export_snapshot, restore_snapshot, SNAPSHOT_EXTENSION
+from scheduler import ScheduledGroq, ScheduledGeminiEmbedding, priority, INTERACTIVE, BACKGROUND
 import tempfile
 import os
 import json
 import re
+import codecs
+import mmap
+import zipfile
+import xml.etree.ElementTree as ET
+from collections import Counter
+
+CHUNK_SIZE = 512  # Tokens per chunk sent to the embedding model
+CHUNK_OVERLAP = 64
+BOILERPLATE_MIN_PAGES = 3  # A line must repeat on at least this many pages...
+BOILERPLATE_PAGE_RATIO = 0.5  # ...and on at least this share of pages to be dropped
+BOILERPLATE_MARGIN_LINES = 2  # Headers/footers are looked for in this many lines at each page edge
+HEADING_PATTERN = re.compile(r'^(#{1,6})\s+(.+?)\s*#*$')
+TEXT_BLOCK_SIZE = 64 * 1024  # Bytes decoded at a time when streaming text files
+SECTION_MAX_CHARS = CHUNK_SIZE * 32  # Flush long heading-less sections to the splitter in batches
+FALLBACK_ENCODING = "cp1252"
+TEXT_BOMS = [  # UTF-32 first: its little-endian BOM starts with the UTF-16 one
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+DEFAULT_RETRIEVAL_QUERY = "key concepts, definitions and main ideas"
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+TOC_LEADER_DOTS = 4  # Dots needed before a trailing page number to count as a table of contents entry
+PAGE_NUMBER_PATTERN = re.compile(r'^[-–— ]*(?:page\s*)?\d+(?:\s*(?:of|/)\s*\d+)?[-–— ]*$', re.IGNORECASE)
 
 # Initialize session state variables
 if "api_key" not in st.session_state:
@@ -20,6 +48,14 @@ if "current_page" not in st.session_state:
     st.session_state.current_page = "upload"
 if "index" not in st.session_state:
     st.session_state.index = None
+if "bm25_index" not in st.session_state:
+    st.session_state.bm25_index = None
+if "retrieval_mode" not in st.session_state:
+    st.session_state.retrieval_mode = "hybrid"
+if "document_ids" not in st.session_state:
+    st.session_state.document_ids = {}
+if "assessment_filenames" not in st.session_state:
+    st.session_state.assessment_filenames = []
 if "current_assessment" not in st.session_state:
     st.session_state.current_assessment = None
 if "user_answers" not in st.session_state:
@@ -29,33 +65,287 @@ if "assessment_score" not in st.session_state:
 if "current_question_index" not in st.session_state:
     st.session_state.current_question_index = 0
 
+def file_buffer(file):
+    """Return a zero-copy view of an uploaded file's bytes."""
+    if hasattr(file, "getbuffer"):
+        return file.getbuffer()
+    if os.fstat(file.fileno()).st_size == 0:
+        return memoryview(b"")  # Empty files cannot be mapped
+    return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+def detect_encoding(head):
+    for bom, encoding in TEXT_BOMS:
+        if bytes(head[:len(bom)]) == bom:
+            return encoding
+    return "utf-8"
+
+def iter_text_blocks(buffer, block_size=TEXT_BLOCK_SIZE):
+    """Decode a byte buffer block by block, falling back to FALLBACK_ENCODING on invalid UTF-8."""
+    encoding = detect_encoding(buffer[:4])
+    # Only BOM-less UTF-8 is decoded strictly, so invalid bytes can switch it to the fallback
+    decoder = codecs.getincrementaldecoder(encoding)(errors="strict" if encoding == "utf-8" else "replace")
+    
+    offset = 0
+    while offset < len(buffer):
+        block = buffer[offset:offset + block_size]
+        try:
+            text = decoder.decode(block)
+        except UnicodeDecodeError as error:
+            # Keep the valid UTF-8 prefix, then re-decode the rest with the fallback encoding
+            pending, _ = decoder.getstate()
+            text = (pending + bytes(block))[:error.start].decode(encoding)
+            offset += error.start - len(pending)
+            encoding = FALLBACK_ENCODING
+            decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+            if text:
+                yield text
+            continue
+        offset += len(block)
+        if text:
+            yield text
+    
+    try:
+        text = decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        # The file ended inside an incomplete UTF-8 sequence
+        pending, _ = decoder.getstate()
+        text = pending.decode(FALLBACK_ENCODING, errors="replace")
+    if text:
+        yield text
+
+def split_long_line(line, max_chars=SECTION_MAX_CHARS):
+    """Split a line into pieces of at most max_chars, at spaces where possible."""
+    while len(line) > max_chars:
+        cut = line.rfind(" ", 0, max_chars) + 1 or max_chars
+        yield line[:cut]
+        line = line[cut:]
+    yield line
+
+def iter_text_lines(file, max_chars=SECTION_MAX_CHARS):
+    """Yield the lines of a text file; lines longer than max_chars are split."""
+    pending = []  # Pieces of a line that continues into the next block
+    size = 0
+    after_cr = False
+    for block in iter_text_blocks(file_buffer(file)):
+        # A '\r\n' split across blocks already ended the line at the '\r'
+        if after_cr and block.startswith("\n"):
+            block = block[1:]
+        after_cr = block.endswith("\r")
+        
+        for line in block.splitlines(keepends=True):
+            text = line.splitlines()[0]
+            if text != line:
+                # Terminated line: only the last one of a block can be open
+                pending.append(text)
+                yield from split_long_line("".join(pending), max_chars)
+                pending = []
+                size = 0
+            else:
+                pending.append(line)
+                size += len(line)
+        
+        if size > max_chars:
+            *done, rest = split_long_line("".join(pending), max_chars)
+            yield from done
+            pending = [rest]
+            size = len(rest)
+    if pending:
+        yield "".join(pending)
+
+def docx_paragraph_text(paragraph):
+    return "".join(node.text or "" for node in paragraph.iter(W_NS + "t"))
+
+def docx_heading_level(paragraph):
+    style = paragraph.find(f"{W_NS}pPr/{W_NS}pStyle")
+    name = style.get(W_NS + "val", "") if style is not None else ""
+    if name == "Title":
+        return 1
+    match = re.fullmatch(r'Heading(\d)', name)
+    return min(int(match.group(1)), 6) if match else 0
+
+def iter_docx_lines(file):
+    """Stream paragraphs and table rows from a DOCX without building the full document tree."""
+    with zipfile.ZipFile(file) as archive, archive.open("word/document.xml") as xml_file:
+        table_depth = 0
+        row, cell = [], []
+        
+        for event, elem in ET.iterparse(xml_file, events=("start", "end")):
+            if event == "start":
+                if elem.tag == W_NS + "tbl":
+                    table_depth += 1
+                continue
+            
+            if elem.tag == W_NS + "p":
+                text = docx_paragraph_text(elem)
+                if table_depth:
+                    cell.append(text)
+                else:
+                    level = docx_heading_level(elem)
+                    yield f"{'#' * level} {text}" if level and text.strip() else text
+                elem.clear()
+            elif elem.tag == W_NS + "tc":
+                row.append(" ".join(t for t in cell if t.strip()).replace('|', '/'))
+                cell = []
+                elem.clear()
+            elif elem.tag == W_NS + "tr":
+                if any(row):
+                    yield "| " + " | ".join(row) + " |"
+                row = []
+                elem.clear()
+            elif elem.tag == W_NS + "tbl":
+                table_depth -= 1
+                yield ""
+                elem.clear()
+
+def read_pdf_pages(file):
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
+        tmp_file.write(file_buffer(file))
+        tmp_file_path = tmp_file.name
+    try:
+        page_chunks = pymupdf4llm.to_markdown(tmp_file_path, page_chunks=True)
+    finally:
+        os.unlink(tmp_file_path)
+    return [page["text"] for page in page_chunks]
+
 def read_file(file):
+    """Yield the file's text line by line, ready for chunking."""
     if file.name.endswith('.pdf'):
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            tmp_file.write(file.getvalue())
-            tmp_file_path = tmp_file.name
-        try:
-            md_text = pymupdf4llm.to_markdown(tmp_file_path)
-        finally:
-            os.unlink(tmp_file_path)
-        return md_text
+        pages = read_pdf_pages(file)
+        return strip_boilerplate(pages, find_boilerplate(pages))
     elif file.name.endswith('.docx'):
-        return "\n".join(para.text for para in DocxDocument(file).paragraphs)
+        return iter_docx_lines(file)
     else:
-        return file.getvalue().decode()
+        return iter_text_lines(file)
 
-def process_documents(uploaded_files):
-    documents = [Document(text=read_file(file), metadata={"filename": file.name}) 
-                for file in uploaded_files]
+def normalize_line(line):
+    # Lines are compared exactly, except page numbers ("Page 3", "3 of 12", "- 3 -")
+    line = re.sub(r'[*_`]', '', line).strip()
+    if PAGE_NUMBER_PATTERN.match(line):
+        return re.sub(r'\d+', '0', line.lower())
+    return line
+
+def page_margins(lines):
+    """Return the indices of the first and last few non-empty lines of a page."""
+    filled = [i for i, line in enumerate(lines)
+              if line.strip() and not line.lstrip().startswith(('#', '|'))]
+    # On short pages (slides, forms) the margins would cover the body itself
+    if len(filled) <= 2 * BOILERPLATE_MARGIN_LINES:
+        return set()
+    return set(filled[:BOILERPLATE_MARGIN_LINES] + filled[-BOILERPLATE_MARGIN_LINES:])
+
+def find_boilerplate(pages):
+    """Find normalized header/footer lines repeated in the margins of many pages."""
+    if len(pages) < BOILERPLATE_MIN_PAGES:
+        return set()
+    
+    page_counts = Counter()
+    for page in pages:
+        lines = page.split('\n')
+        page_counts.update({normalize_line(lines[i]) for i in page_margins(lines)})
+    
+    threshold = max(BOILERPLATE_MIN_PAGES, len(pages) * BOILERPLATE_PAGE_RATIO)
+    return {line for line, count in page_counts.items()
+            if count >= threshold and re.search(r'\w', line)}
+
+def strip_boilerplate(pages, boilerplate):
+    for page in pages:
+        lines = page.split('\n')
+        margins = page_margins(lines) if boilerplate else set()
+        for i, line in enumerate(lines):
+            if i in margins and normalize_line(line) in boilerplate:
+                continue
+            yield line
+
+def split_sections(lines, max_chars=SECTION_MAX_CHARS):
+    """Group markdown lines into (heading path, text) sections of bounded size."""
+    headings = []  # Stack of (level, title) for the current heading path
+    section = []
+    size = 0
+    
+    for line in lines:
+        match = HEADING_PATTERN.match(line.strip())
+        # Long sections are handed on at a paragraph break, or mid-paragraph past twice the limit
+        flush = match or (size >= max_chars and not line.strip()) or size >= 2 * max_chars
+        if flush:
+            if any(l.strip() for l in section):
+                yield [title for _, title in headings], "\n".join(section).strip()
+            section = []
+            size = 0
+        if match:
+            level = len(match.group(1))
+            while headings and headings[-1][0] >= level:
+                headings.pop()
+            headings.append((level, match.group(2).strip('*_ ')))
+        else:
+            section.append(line)
+            size += len(line) + 1
     
-    d = 768  # Dimension for Google embeddings
-    faiss_index = faiss.IndexFlatL2(d)
+    if any(l.strip() for l in section):
+        yield [title for _, title in headings], "\n".join(section).strip()
+
+def is_toc_line(line):
+    """Whether a line ends in a dot or ellipsis leader followed by a page number."""
+    # Plain string scans from the end of the line, so long dotted lines stay linear
+    line = line.rstrip()
+    body = line.rstrip("0123456789")
+    if body == line:
+        return False
+    body = body.rstrip(" \t")
+    if body.endswith("…"):
+        return True
+    return body[len(body.rstrip(". \t")):].count(".") >= TOC_LEADER_DOTS
+
+def chunk_document(filename, lines, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """Split a document along its heading hierarchy into chunks of at most chunk_size tokens."""
+    splitter = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    lines = (line for line in lines if not is_toc_line(line))
+    
+    for headings, text in split_sections(lines):
+        section = Document(
+            text=text,
+            metadata={"filename": filename, "headings": " > ".join(headings)}
+        )
+        yield from splitter.get_nodes_from_documents([section])
+
+def configure_models():
+    # Retries are handled by the shared scheduler, with backoff across all sessions
+    Settings.llm = ScheduledGroq(
+        api_key=st.session_state.api_key,
+        model="llama-3.3-70b-versatile",
+        max_retries=0
+    )
+    Settings.embed_model = ScheduledGeminiEmbedding(api_key=st.session_state.google_api_key)
+
+def process_documents(uploaded_files, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    nodes = []
+    for file in uploaded_files:
+        nodes.extend(chunk_document(file.name, read_file(file), chunk_size, chunk_overlap))
+    
+    faiss_index = faiss.IndexFlatL2(EMBED_DIMENSION)
     vector_store = FaissVectorStore(faiss_index=faiss_index)
+    storage_context = StorageContext.from_defaults(vector_store=vector_store)
     
-    st.session_state.index = VectorStoreIndex.from_documents(
-        documents,
-        vector_store=vector_store
+    with priority(BACKGROUND):
+        st.session_state.index = VectorStoreIndex(
+            nodes,
+            storage_context=storage_context
+        )
+    st.session_state.bm25_index = BM25Index(nodes)
+    st.session_state.document_ids = build_document_ids(st.session_state.index)
+
+def get_query_engine(filenames=None):
+    retriever = HybridRetriever(
+        st.session_state.index,
+        st.session_state.bm25_index,
+        mode=st.session_state.retrieval_mode,
+        document_ids=st.session_state.document_ids,
+        filenames=filenames
     )
+    return RetrieverQueryEngine.from_args(retriever, response_mode="compact")
+
+def retrieval_query(prompt, search_text):
+    # Retrieve by subject matter only; the instructions and output format go to the LLM
+    return QueryBundle(query_str=prompt, custom_embedding_strs=[search_text])
 
 def parse_mcq_response(response):
     questions = []
@@ -84,7 +374,7 @@ def parse_mcq_response(response):
     
     return questions
 
-def generate_mcq(context, num_questions=5, difficulty="medium", topics=None):
+def generate_mcq(context, num_questions=5, difficulty="medium", topics=None, filenames=None):
     topic_str = f" focusing on {', '.join(topics)}" if topics else ""
     prompt = f"""
     Based on the following context, generate {num_questions} {difficulty}-level multiple choice questions{topic_str}.
@@ -102,13 +392,12 @@ def generate_mcq(context, num_questions=5, difficulty="medium", topics=None):
     Context: {context}
     """
     
-    query_engine = st.session_state.index.as_query_engine(
-        response_mode="compact"
-    )
-    response = query_engine.query(prompt)
+    query_engine = get_query_engine(filenames)
+    search_text = ", ".join(topics) if topics else DEFAULT_RETRIEVAL_QUERY
+    response = query_engine.query(retrieval_query(prompt, search_text))
     return parse_mcq_response(str(response))
 
-def generate_free_response(context, num_questions=3, difficulty="medium", topics=None):
+def generate_free_response(context, num_questions=3, difficulty="medium", topics=None, filenames=None):
     topic_str = f" focusing on {', '.join(topics)}" if topics else ""
     prompt = f"""
     Based on the context, generate {num_questions} {difficulty}-level open-ended questions{topic_str} that test understanding
@@ -118,13 +407,12 @@ def generate_free_response(context, num_questions=3, difficulty="medium", topics
     3. A model answer for reference
     4. Scoring criteria (what makes an answer excellent, good, or needs improvement)
     """
-    query_engine = st.session_state.index.as_query_engine(
-        response_mode="compact"
-    )
-    response = query_engine.query(prompt)
+    query_engine = get_query_engine(filenames)
+    search_text = ", ".join(topics) if topics else DEFAULT_RETRIEVAL_QUERY
+    response = query_engine.query(retrieval_query(prompt, search_text))
     return str(response)
 
-def evaluate_free_response(question, model_answer, user_answer):
+def evaluate_free_response(question, model_answer, user_answer, filenames=None):
     prompt = f"""
     Evaluate the following student answer against the model answer and provide:
     1. Score (0-100)
@@ -136,10 +424,9 @@ def evaluate_free_response(question, model_answer, user_answer):
     Student Answer: {user_answer}
     """
     
-    query_engine = st.session_state.index.as_query_engine(
-        response_mode="compact"
-    )
-    response = query_engine.query(prompt)
+    query_engine = get_query_engine(filenames)
+    with priority(INTERACTIVE):
+        response = query_engine.query(retrieval_query(prompt, question))
     return str(response)
 
 # Streamlit UI
@@ -150,6 +437,12 @@ with st.sidebar:
     st.header("🔑 API Keys")
     st.session_state.api_key = st.text_input("Enter your Groq API Key:", type="password")
     st.session_state.google_api_key = st.text_input("Enter your Google API Key:", type="password")
+    st.selectbox(
+        "Retrieval mode:",
+        RETRIEVAL_MODES,
+        key="retrieval_mode",
+        help="Sparse (BM25) retrieval skips the query-embedding API call"
+    )
     
     if st.session_state.current_page == "upload":
         st.header("📁 Document Upload")
@@ -161,15 +454,34 @@ with st.sidebar:
         
         if uploaded_files and st.session_state.api_key and st.session_state.google_api_key:
             with st.spinner("Processing documents..."):
-                llm = Groq(api_key=st.session_state.api_key, model="llama-3.3-70b-versatile")
-                embed_model = GeminiEmbedding(api_key=st.session_state.google_api_key)
-                
-                Settings.embed_model = embed_model
-                Settings.llm = llm
-                
+                configure_models()
                 process_documents(uploaded_files)
             st.success(f"{len(uploaded_files)} document(s) processed successfully!")
             st.session_state.current_page = "menu"
+        
+        snapshot_file = st.file_uploader(
+            "Or resume a saved session:",
+            type=[SNAPSHOT_EXTENSION]
+        )
+        
+        if snapshot_file and st.session_state.api_key and st.session_state.google_api_key:
+            configure_models()
+            try:
+                restore_snapshot(snapshot_file, st.session_state)
+            except ValueError as e:
+                st.error(f"Could not restore session: {e}")
+            else:
+                st.success("Session restored!")
+    
+    elif st.session_state.index is not None:
+        st.header("💾 Session")
+        if st.button("Save Session Snapshot"):
+            st.download_button(
+                "Download Snapshot",
+                data=export_snapshot(st.session_state),
+                file_name=f"assessment_session.{SNAPSHOT_EXTENSION}",
+                mime="application/zip"
+            )
 
 # Main content area
 st.title("📚 Interactive Learning Assessment")
@@ -209,14 +521,21 @@ elif st.session_state.current_page == "mcq_config":
             ["Topic 1", "Topic 2", "Topic 3"],  # You can dynamically generate these from the documents
             default=None
         )
+        filenames = st.multiselect(
+            "Limit to documents (optional):",
+            sorted(st.session_state.document_ids),
+            default=None
+        )
     
     if st.button("Start Assessment"):
         with st.spinner("Generating questions..."):
+            st.session_state.assessment_filenames = filenames
             st.session_state.current_assessment = generate_mcq(
                 context="",
                 num_questions=num_questions,
                 difficulty=difficulty,
-                topics=topics
+                topics=topics,
+                filenames=filenames
             )
             st.session_state.current_question_index = 0
             st.session_state.user_answers = {}
@@ -310,14 +629,21 @@ elif st.session_state.current_page == "free_response_config":
             ["Topic 1", "Topic 2", "Topic 3"],  # You can dynamically generate these
             default=None
         )
+        filenames = st.multiselect(
+            "Limit to documents (optional):",
+            sorted(st.session_state.document_ids),
+            default=None
+        )
     
     if st.button("Start Assessment"):
         with st.spinner("Generating questions..."):
+            st.session_state.assessment_filenames = filenames
             st.session_state.current_assessment = generate_free_response(
                 context="",
                 num_questions=num_questions,
                 difficulty=difficulty,
-                topics=topics
+                topics=topics,
+                filenames=filenames
             )
             st.session_state.current_page = "free_response_assessment"
             st.rerun()
@@ -336,7 +662,8 @@ elif st.session_state.current_page == "free_response_assessment":
                     evaluation = evaluate_free_response(
                         question_block,
                         "Model answer from question block",
-                        answer
+                        answer,
+                        filenames=st.session_state.assessment_filenames
                     )
                     st.write("### Evaluation")
                     st.write(evaluation)
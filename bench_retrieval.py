@@ -0,0 +1,186 @@
+"""Benchmark latency and retrieval quality of the dense, sparse and hybrid modes.
+
+Usage:
+    python bench_retrieval.py notes.pdf chapter2.docx [--queries labeled.jsonl] [--embed lsa]
+
+Files are read and chunked with the app's own read_file and chunk_document, so
+the indexes are the ones the app builds. Two query sets are generated from the
+chunks:
+
+- sentence: one sentence sampled from each chunk; the chunk itself is relevant
+- heading: the title of each heading section, a keyword-style topic query;
+  every chunk of that section is relevant
+
+A labeled JSONL file (--queries) replaces both with {"query": ..., "answer": ...}
+lines; a query counts as a hit when a retrieved chunk contains the answer text.
+
+--embed selects the dense model: "gemini" (GOOGLE_API_KEY, the model the app
+uses, including its query-embedding round-trip), "huggingface" (a local
+sentence-transformers model, downloaded on first use) or "lsa" (TF-IDF + SVD
+from scikit-learn, fitted on the corpus; needs no network or key, but is a
+weaker stand-in for a neural model, so dense and hybrid quality are understated).
+"""
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import time
+
+import faiss
+import numpy as np
+from llama_index.core import QueryBundle, Settings, StorageContext, VectorStoreIndex
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.embeddings import BaseEmbedding
+from llama_index.vector_stores.faiss import FaissVectorStore
+
+import app  # Runs in Streamlit's bare mode; only its reader and chunker are used
+from retrieval import BM25Index, HybridRetriever, RETRIEVAL_MODES, RETRIEVAL_TOP_K, HYBRID_ALPHA
+
+
+class LSAEmbedding(BaseEmbedding):
+    """TF-IDF + truncated SVD embedding fitted on the benchmark corpus."""
+
+    _vectorizer = PrivateAttr()
+    _svd = PrivateAttr()
+
+    def fit(self, texts, dimensions=256):
+        from sklearn.decomposition import TruncatedSVD
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        self._vectorizer = TfidfVectorizer(sublinear_tf=True, stop_words="english")
+        matrix = self._vectorizer.fit_transform(texts)
+        self._svd = TruncatedSVD(n_components=min(dimensions, matrix.shape[1] - 1), random_state=0)
+        self._svd.fit(matrix)
+        return self
+
+    def _embed(self, text):
+        vector = self._svd.transform(self._vectorizer.transform([text]))[0]
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def _get_query_embedding(self, query):
+        return self._embed(query)
+
+    def _get_text_embedding(self, text):
+        return self._embed(text)
+
+    async def _aget_query_embedding(self, query):
+        return self._embed(query)
+
+
+def load_embed_model(name, nodes):
+    if name == "gemini":
+        from llama_index.embeddings.gemini import GeminiEmbedding
+        return GeminiEmbedding(api_key=os.environ["GOOGLE_API_KEY"])
+    if name == "huggingface":
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+        return HuggingFaceEmbedding(model_name="BAAI/bge-small-en-v1.5")
+    return LSAEmbedding(model_name="lsa").fit([node.get_content() for node in nodes])
+
+
+def chunk_files(paths, chunk_size):
+    nodes = []
+    for path in paths:
+        with open(path, "rb") as file:
+            nodes.extend(app.chunk_document(os.path.basename(path), app.read_file(file), chunk_size))
+    return nodes
+
+
+def build_indexes(nodes):
+    d = len(Settings.embed_model.get_text_embedding("dimension probe"))
+    vector_store = FaissVectorStore(faiss_index=faiss.IndexFlatL2(d))
+    storage_context = StorageContext.from_defaults(vector_store=vector_store)
+    index = VectorStoreIndex(nodes, storage_context=storage_context)
+    return index, BM25Index(nodes)
+
+
+def sentence_queries(nodes, rng):
+    queries = []
+    for node in nodes:
+        sentences = [s for s in re.split(r'(?<=[.!?])\s+', node.get_content()) if len(s.split()) >= 6]
+        if sentences:
+            queries.append((rng.choice(sentences), {node.node_id}))
+    return queries
+
+
+def heading_queries(nodes):
+    sections = {}
+    for node in nodes:
+        headings = node.metadata.get("headings")
+        if headings:
+            key = (node.metadata["filename"], headings)
+            sections.setdefault(key, set()).add(node.node_id)
+    return [(headings.split(" > ")[-1], node_ids) for (_, headings), node_ids in sections.items()]
+
+
+def labeled_queries(path):
+    with open(path, encoding="utf-8") as f:
+        items = [json.loads(line) for line in f if line.strip()]
+    return [(item["query"], item["answer"].lower()) for item in items]
+
+
+def is_relevant(result, expected):
+    if isinstance(expected, str):
+        return expected in result.node.get_content().lower()
+    return result.node.node_id in expected
+
+
+def run_mode(retriever, queries):
+    latencies = []
+    reciprocal_ranks = []
+    for query, expected in queries:
+        start = time.perf_counter()
+        results = retriever.retrieve(QueryBundle(query))
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        rank = next((i + 1 for i, result in enumerate(results) if is_relevant(result, expected)), None)
+        reciprocal_ranks.append(1 / rank if rank else 0)
+
+    latencies.sort()
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "recall": sum(1 for rr in reciprocal_ranks if rr) / len(queries),
+        "mrr": statistics.mean(reciprocal_ranks),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="PDF, DOCX or text files to index")
+    parser.add_argument("--queries", help="JSONL file of labeled {query, answer} pairs")
+    parser.add_argument("--embed", choices=["lsa", "huggingface", "gemini"], default="lsa")
+    parser.add_argument("--chunk-size", type=int, default=app.CHUNK_SIZE)
+    parser.add_argument("--top-k", type=int, default=RETRIEVAL_TOP_K)
+    parser.add_argument("--alpha", type=float, default=HYBRID_ALPHA, help="Dense weight for hybrid fusion")
+    parser.add_argument("--max-queries", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    nodes = chunk_files(args.files, args.chunk_size)
+    Settings.embed_model = load_embed_model(args.embed, nodes)
+    index, bm25_index = build_indexes(nodes)
+
+    if args.queries:
+        query_sets = {"labeled": labeled_queries(args.queries)}
+    else:
+        query_sets = {"sentence": sentence_queries(nodes, rng), "heading": heading_queries(nodes)}
+    print(f"{len(nodes)} chunks from {len(args.files)} files, embed={args.embed}, "
+          f"top_k={args.top_k}, alpha={args.alpha}")
+
+    for name, queries in query_sets.items():
+        queries = rng.sample(queries, min(len(queries), args.max_queries))
+        print(f"\n{name} queries ({len(queries)})")
+        print(f"{'mode':<8} {'p50 ms':>9} {'p95 ms':>9} {'recall@k':>9} {'MRR':>7}")
+        for mode in RETRIEVAL_MODES:
+            retriever = HybridRetriever(index, bm25_index, mode=mode, top_k=args.top_k, alpha=args.alpha)
+            stats = run_mode(retriever, queries)
+            print(f"{mode:<8} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} "
+                  f"{stats['recall']:>9.3f} {stats['mrr']:>7.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,415 @@
+"""Load test: drive concurrent simulated sessions through the real app.py page flow.
+
+Usage:
+    python loadtest.py --levels 1,2,4,8,16 [--corpus notes.pdf ...] [--flow both]
+
+Each simulated student is a Streamlit AppTest instance running app.py:
+upload -> menu -> mcq_config -> mcq_assessment -> mcq_results, then
+menu -> free_response_config -> free_response_assessment (grading a few
+answers) -> menu. Groq and Gemini are replaced by local stub backends with a
+configurable latency; the stubs still go through the scheduler, so its rate
+limits apply (use --no-limits to measure the app alone).
+
+Every session runs in its own process. AppTest swaps process-global state on
+each run (Runtime._instance, patched config options) and is not thread-safe,
+so concurrent AppTests in one process corrupt each other. The price is that
+each process has its own scheduler, unlike the Streamlit server where all
+sessions share one:
+
+- per-key limits behave as in production, since every session has its own key
+- the provider-wide limits are split evenly between the sessions of a level,
+  a static share of what is a shared, work-conserving bucket in production
+- requests are never coalesced across sessions (tests/test_scheduler.py covers that)
+
+A Streamlit server runs all its sessions as threads of one process, sharing
+one CPU budget. So that separate processes do not get more CPU than that, every
+session process is pinned to the same core(s): one by default, --cores to
+model a server with more (where platforms lack sched_setaffinity the processes
+are unpinned, and the numbers are per-process rather than per-server). Even
+pinned to several cores the processes are not held back by a shared GIL, so
+multi-core results are an upper bound for one server instance.
+
+All sessions of a level start together once their processes have been warmed
+up by an untimed session. For each concurrency level the report gives p50/p99
+latency per page, resident memory added by a session to its process and
+session throughput. The saturation point is the last level whose throughput
+still grew by at least --saturation-gain over the best lower level.
+"""
+import argparse
+import gc
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+import time
+import traceback
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
+
+import numpy as np
+import streamlit
+from llama_index.core.embeddings import BaseEmbedding
+from llama_index.core.llms import CompletionResponse, CustomLLM, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+from streamlit.testing.v1 import AppTest
+
+import scheduler
+from retrieval import EMBED_DIMENSION
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+UNLIMITED = (1e9, 1e9)
+
+_barrier = None  # Set in each session process by init_worker
+
+SAMPLE_CORPUS = "\n\n".join(
+    f"# Chapter {chapter}\n\n"
+    + "\n\n".join(
+        f"## Section {chapter}.{section}\n\n"
+        + " ".join(f"Concept {chapter}.{section}.{n} relates cells, energy and transport in organisms."
+                   for n in range(40))
+        for section in range(1, 6)
+    )
+    for chapter in range(1, 6)
+)
+
+
+class StubLLM(CustomLLM):
+    """Local LLM returning canned output in the formats app.py parses."""
+
+    api_key: str = ""
+    latency: float = 0.0
+
+    @property
+    def metadata(self):
+        return LLMMetadata(model_name="loadtest-stub")
+
+    def _respond(self, prompt):
+        time.sleep(self.latency)
+        if "multiple choice" in prompt:
+            count = int(re.search(r'generate (\d+)', prompt).group(1))
+            return "\n".join(
+                f"Q{i}. Which statement about concept {i} is correct?\n"
+                "a) The first\nb) The second\nc) The third\nd) The fourth\n"
+                f"Correct Answer: {'abcd'[i % 4]}"
+                for i in range(1, count + 1)
+            )
+        if "open-ended" in prompt:
+            count = int(re.search(r'generate (\d+)', prompt).group(1))
+            return "\n\n".join(
+                f"{i}. Explain concept {i} in your own words.\n"
+                "Key points: definition, example, consequence.\n"
+                "Model answer: Concept relates cells to energy."
+                for i in range(1, count + 1)
+            )
+        return "Score: 75\nFeedback: Covers the main idea.\nAreas for improvement: Add an example."
+
+    @llm_completion_callback()
+    def complete(self, prompt, formatted=False, **kwargs):
+        key = scheduler.request_key(self.api_key)
+        text = scheduler.scheduler.call(
+            "groq", key,
+            lambda: self._respond(prompt),
+            coalesce_key=scheduler.request_key(key, "complete", prompt),
+        )
+        return CompletionResponse(text=text)
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt, formatted=False, **kwargs):
+        yield self.complete(prompt, formatted=formatted, **kwargs)
+
+
+class StubEmbedding(BaseEmbedding):
+    """Local embedding model returning deterministic pseudo-random vectors."""
+
+    api_key: str = ""
+    latency: float = 0.0
+
+    def _embed(self, texts):
+        time.sleep(self.latency)
+        return [
+            np.random.default_rng(int(hashlib.sha256(text.encode()).hexdigest()[:16], 16))
+            .standard_normal(EMBED_DIMENSION).tolist()
+            for text in texts
+        ]
+
+    def _scheduled(self, texts):
+        key = scheduler.request_key(self.api_key)
+        return scheduler.scheduler.call(
+            "gemini", key,
+            lambda: self._embed(texts),
+            coalesce_key=scheduler.request_key(key, "embed", texts),
+        )
+
+    def _get_query_embedding(self, query):
+        return self._scheduled([query])[0]
+
+    def _get_text_embedding(self, text):
+        return self._scheduled([text])[0]
+
+    def _get_text_embeddings(self, texts):
+        return self._scheduled(texts)
+
+    async def _aget_query_embedding(self, query):
+        return self._get_query_embedding(query)
+
+
+class UploadedStub(io.BytesIO):
+    """Stands in for Streamlit's UploadedFile, which is a named BytesIO."""
+
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+
+
+def load_corpus(paths):
+    if not paths:
+        return [("sample.txt", SAMPLE_CORPUS.encode())]
+    corpus = []
+    for path in paths:
+        with open(path, "rb") as f:
+            corpus.append((os.path.basename(path), f.read()))
+    return corpus
+
+
+def make_file_uploader(corpus):
+    def file_uploader(label, *args, accept_multiple_files=False, **kwargs):
+        # AppTest has no file uploader support; hand back the corpus for the document
+        # uploader and nothing for the snapshot uploader
+        if not accept_multiple_files:
+            return None
+        return [UploadedStub(name, data) for name, data in corpus]
+    return file_uploader
+
+
+def find_button(at, label):
+    return next(button for button in at.button if button.label == label)
+
+
+class Session:
+    """One simulated student walking the app's pages."""
+
+    def __init__(self, session_id, args, timings):
+        self.args = args
+        self.timings = timings
+        self.at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+        self.session_id = session_id
+
+    def step(self, page, action=None):
+        """Perform an action, rerun, and record the time until the page is rendered."""
+        at = self.at
+        if action is not None:
+            action()
+        before = (at.session_state["current_page"], at.session_state["current_question_index"])
+        start = time.perf_counter()
+        at.run()
+        # Navigation buttons change state without st.rerun(), so the new page
+        # only renders on the following run, as in the browser
+        if (at.session_state["current_page"], at.session_state["current_question_index"]) != before:
+            at.run()
+        self.timings[page].append(time.perf_counter() - start)
+        if at.exception:
+            raise RuntimeError(f"{page}: {at.exception[0].message}")
+
+    def run_mcq(self):
+        at = self.at
+        self.step("mcq_config", find_button(at, "📝 Knowledge Assessment (MCQ)").click)
+        at.slider[0].set_value(self.args.mcq_questions)
+        self.step("mcq_assessment", find_button(at, "Start Assessment").click)
+
+        total = len(at.session_state["current_assessment"])
+        for i in range(total):
+            at.radio[0].set_value("abcd"[(self.session_id + i) % 4])
+            if i < total - 1:
+                self.step("mcq_assessment", find_button(at, "Next Question").click)
+            else:
+                self.step("mcq_results", find_button(at, "Submit Assessment").click)
+        self.step("menu", find_button(at, "Return to Menu").click)
+
+    def run_free_response(self):
+        at = self.at
+        self.step("free_response_config", find_button(at, "💭 Skills Development (Free Response)").click)
+        self.step("free_response_assessment", find_button(at, "Start Assessment").click)
+
+        for i in range(min(self.args.graded_answers, len(at.text_area))):
+            at.text_area[i].input(f"Student {self.session_id} answer: concept {i} links cells and energy.")
+            self.step("free_response_grading", find_button(at, f"Submit Answer {i + 1}").click)
+        self.step("menu", find_button(at, "Finish Assessment").click)
+
+    def run(self):
+        at = self.at
+        at.run()
+        at.sidebar.text_input[0].input(f"groq-key-{self.session_id}")
+        at.sidebar.text_input[1].input(f"google-key-{self.session_id}")
+        at.sidebar.selectbox[0].set_value(self.args.retrieval_mode)
+        self.step("upload")
+
+        if self.args.flow in ("mcq", "both"):
+            self.run_mcq()
+        if self.args.flow in ("free_response", "both"):
+            self.run_free_response()
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def init_worker(args, corpus, level, barrier):
+    """Set up a session process: stub backends, a warm-up session and its share of the limits."""
+    global _barrier
+    _barrier = barrier
+    if args.cores:
+        os.sched_setaffinity(0, args.cores)
+
+    # The process exits after its session, so the patches are never undone
+    mock.patch.object(streamlit, "file_uploader", make_file_uploader(corpus)).start()
+    mock.patch.object(scheduler, "ScheduledGroq",
+                      lambda api_key="", **kwargs: StubLLM(api_key=api_key, latency=args.llm_latency)).start()
+    mock.patch.object(scheduler, "ScheduledGeminiEmbedding",
+                      lambda api_key="", **kwargs: StubEmbedding(api_key=api_key, latency=args.embed_latency)).start()
+
+    # The first session in a process pays ~160 MiB and seconds of one-off lazy
+    # initialisation (tokenizers, Streamlit internals); run an untimed one first
+    # so the measured session sees the same warm process as in a long-running server
+    scheduler.scheduler = scheduler.Scheduler(provider_limits=defaultdict(lambda: UNLIMITED),
+                                              key_limits=defaultdict(lambda: UNLIMITED))
+    Session(-1, args, defaultdict(list)).run()
+
+    if args.no_limits:
+        provider_limits = key_limits = defaultdict(lambda: UNLIMITED)
+    else:
+        provider_limits = {provider: (rate / level, max(1, burst // level))
+                           for provider, (rate, burst) in scheduler.PROVIDER_LIMITS.items()}
+        key_limits = scheduler.KEY_LIMITS
+    scheduler.scheduler = scheduler.Scheduler(provider_limits=provider_limits, key_limits=key_limits)
+
+
+def run_session(session_id, args):
+    """Run one session in a worker process; returns its timings, span and memory."""
+    session = Session(session_id, args, defaultdict(list))
+    gc.collect()
+    rss_before = rss_bytes()
+    _barrier.wait(timeout=args.timeout)
+
+    start = time.time()
+    error = None
+    try:
+        session.run()
+    except Exception:
+        error = traceback.format_exc(limit=2)
+    end = time.time()
+
+    gc.collect()
+    rss_after = rss_bytes()
+    return {
+        "timings": dict(session.timings),
+        "start": start,
+        "end": end,
+        # The session is still referenced here, so its index and state are resident
+        "memory": rss_after - rss_before if rss_before is not None else None,
+        "error": error,
+    }
+
+
+def run_level(level, args, corpus):
+    # AppTest runs app.py as __main__ in the workers, so hand them the functions by
+    # their module name rather than as __main__.run_session
+    import loadtest
+
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(level)
+    with ProcessPoolExecutor(max_workers=level, mp_context=context, initializer=loadtest.init_worker,
+                             initargs=(args, corpus, level, barrier)) as pool:
+        # Every session waits on the barrier, so no process can pick up a second one
+        sessions = list(pool.map(loadtest.run_session, range(level), [args] * level))
+
+    timings = defaultdict(list)
+    for session in sessions:
+        for page, values in session["timings"].items():
+            timings[page].extend(values)
+    errors = [session["error"] for session in sessions if session["error"]]
+    memory = [session["memory"] for session in sessions if session["memory"] is not None]
+    wall = max(session["end"] for session in sessions) - min(session["start"] for session in sessions)
+
+    completed = level - len(errors)
+    return {
+        "level": level,
+        "wall": wall,
+        "completed": completed,
+        "throughput": completed / wall,
+        "memory_per_session": sum(memory) / len(memory) if memory else None,
+        "timings": timings,
+        "errors": errors,
+    }
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def report(results, saturation_gain):
+    pages = sorted({page for result in results for page in result["timings"]})
+    for result in results:
+        memory = result["memory_per_session"]
+        memory = f"{memory / 2 ** 20:.1f} MiB" if memory is not None else "n/a"
+        print(f"\n== {result['level']} concurrent session(s): {result['completed']} completed "
+              f"in {result['wall']:.2f}s, {result['throughput']:.2f} sessions/s, "
+              f"{memory} per session")
+        print(f"{'page':<26} {'runs':>5} {'p50 ms':>9} {'p99 ms':>9}")
+        for page in pages:
+            values = result["timings"].get(page)
+            if values:
+                print(f"{page:<26} {len(values):>5} {percentile(values, 0.5) * 1000:>9.1f} "
+                      f"{percentile(values, 0.99) * 1000:>9.1f}")
+        for error in result["errors"][:3]:
+            print(f"  error: {error.strip().splitlines()[-1]}")
+
+    saturation = results[0]
+    best = results[0]["throughput"]
+    for result in results[1:]:
+        if result["throughput"] < best * (1 + saturation_gain):
+            break
+        saturation = result
+        best = result["throughput"]
+    print(f"\nThroughput saturates at {saturation['level']} concurrent session(s) "
+          f"({saturation['throughput']:.2f} sessions/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", default="1,2,4,8,16", help="Comma-separated concurrent session counts")
+    parser.add_argument("--corpus", nargs="*", help="Files to upload (default: generated sample text)")
+    parser.add_argument("--flow", choices=["mcq", "free_response", "both"], default="both")
+    parser.add_argument("--mcq-questions", type=int, default=5)
+    parser.add_argument("--graded-answers", type=int, default=2)
+    parser.add_argument("--retrieval-mode", default="hybrid")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Stub LLM seconds per call")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Stub embedding seconds per call")
+    parser.add_argument("--no-limits", action="store_true", help="Disable the scheduler's rate limits")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds allowed per app run")
+    parser.add_argument("--saturation-gain", type=float, default=0.1)
+    parser.add_argument("--cores", help="Comma-separated CPU cores shared by all sessions (default: one core)")
+    args = parser.parse_args()
+
+    if hasattr(os, "sched_setaffinity"):
+        args.cores = ({int(core) for core in args.cores.split(",")} if args.cores
+                      else {min(os.sched_getaffinity(0))})
+        print(f"Session processes pinned to core(s) {sorted(args.cores)}: "
+              f"results model one server instance with that CPU budget")
+    else:
+        args.cores = None
+        print("Session processes are not pinned to cores: results are per-process, not per-server")
+
+    corpus = load_corpus(args.corpus)
+    results = [run_level(int(level), args, corpus) for level in args.levels.split(",")]
+    report(results, args.saturation_gain)
+
+
+if __name__ == "__main__":
+    main()
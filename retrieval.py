@@ -0,0 +1,173 @@
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+
+import faiss
+import numpy as np
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore
+
+EMBED_DIMENSION = 768  # Dimension of the Google embeddings stored in the FAISS index
+RETRIEVAL_MODES = ["hybrid", "dense", "sparse"]
+RETRIEVAL_TOP_K = 2  # Same number of chunks the default query engine used
+RETRIEVAL_CANDIDATES = 10  # Results taken from each retriever before fusion
+HYBRID_ALPHA = 0.5  # Weight of the dense ranking in the fused score (0 = sparse only, 1 = dense only)
+RRF_K = 60  # Reciprocal rank fusion damping constant
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "have",
+    "in", "is", "it", "its", "of", "on", "or", "that", "the", "this", "to", "was",
+    "were", "which", "with",
+}
+
+
+def tokenize(text):
+    return [token for token in re.findall(r'\w+', text.lower()) if token not in STOPWORDS]
+
+
+def build_document_ids(index):
+    """Map each filename to the sorted FAISS ids of its chunks."""
+    document_ids = defaultdict(list)
+    for faiss_id, node_id in index.index_struct.nodes_dict.items():
+        filename = index.docstore.get_node(node_id).metadata.get("filename")
+        document_ids[filename].append(int(faiss_id))
+    return {filename: np.array(sorted(ids), dtype=np.int64) for filename, ids in document_ids.items()}
+
+
+class BM25Index:
+    """In-process inverted index scoring nodes with Okapi BM25."""
+
+    def __init__(self, nodes, k1=BM25_K1, b=BM25_B):
+        self.nodes = list(nodes)
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)  # term -> [(node position, term frequency)]
+        self.doc_lengths = []
+        self.filenames = [node.metadata.get("filename") for node in self.nodes]
+
+        for position, node in enumerate(self.nodes):
+            counts = Counter(tokenize(node.get_content()))
+            for term, tf in counts.items():
+                self.postings[term].append((position, tf))
+            self.doc_lengths.append(sum(counts.values()))
+
+        total = len(self.nodes)
+        self.avg_length = sum(self.doc_lengths) / total if total else 0
+        self.idf = {
+            term: math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def search(self, query, top_k=RETRIEVAL_TOP_K, filenames=None):
+        """Return up to top_k (node, score) pairs for the query, best first.
+
+        If filenames is given, only chunks of those documents are scored.
+        """
+        allowed = set(filenames) if filenames else None
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for position, tf in self.postings[term]:
+                if allowed is not None and self.filenames[position] not in allowed:
+                    continue
+                norm = 1 - self.b + self.b * self.doc_lengths[position] / self.avg_length
+                scores[position] += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [(self.nodes[position], score) for position, score in best]
+
+
+class HybridRetriever(BaseRetriever):
+    """Fuse dense (vector index) and sparse (BM25) rankings with weighted reciprocal rank fusion.
+
+    Both searches use the bundle's embedding strings (its custom_embedding_strs when
+    given), so callers can retrieve by topic while the LLM sees the full prompt.
+    In "sparse" mode the query is never embedded, so no embedding API call is made.
+    If filenames is given, both searches only consider chunks of those documents.
+    A document's chunks are indexed together, so their precomputed FAISS ids (see
+    build_document_ids) form contiguous ranges; the dense search runs an exact
+    search over each range of the flat index's storage in place, so its cost
+    grows with the selection rather than with the whole index.
+    """
+
+    def __init__(self, index, bm25_index, mode="hybrid", top_k=RETRIEVAL_TOP_K,
+                 alpha=HYBRID_ALPHA, candidates=RETRIEVAL_CANDIDATES, rrf_k=RRF_K,
+                 document_ids=None, filenames=None):
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        self.index = index
+        self.bm25_index = bm25_index
+        self.filenames = list(filenames) if filenames else None
+        self.selected_ids = (
+            np.sort(np.concatenate([document_ids.get(name, np.empty(0, dtype=np.int64))
+                                    for name in self.filenames]))
+            if self.filenames else None
+        )
+        # [(start, stop)] ranges of consecutive selected ids
+        self.selected_ranges = (
+            [(int(run[0]), int(run[-1]) + 1)
+             for run in np.split(self.selected_ids, np.flatnonzero(np.diff(self.selected_ids) != 1) + 1)]
+            if self.selected_ids is not None and len(self.selected_ids) else []
+        )
+        self.mode = mode
+        self.top_k = top_k
+        self.alpha = alpha
+        self.candidates = max(candidates, top_k)
+        self.rrf_k = rrf_k
+        super().__init__()
+
+    def _dense(self, query_bundle, top_k):
+        if self.selected_ids is None:
+            return self.index.as_retriever(similarity_top_k=top_k).retrieve(query_bundle)
+        if not len(self.selected_ids):
+            return []
+
+        if query_bundle.embedding is None:
+            # The index's own model, as in the unscoped path: Settings is shared by every session
+            query_bundle.embedding = self.index._embed_model.get_agg_embedding_from_queries(
+                query_bundle.embedding_strs
+            )
+        query = np.array([query_bundle.embedding], dtype=np.float32)
+        client = self.index.vector_store.client
+        # Zero-copy view of the IndexFlatL2 storage; an ID selector would still scan every vector
+        vectors = faiss.rev_swig_ptr(client.get_xb(), client.ntotal * client.d).reshape(client.ntotal, client.d)
+        candidates = []
+        for start, stop in self.selected_ranges:
+            # Squared L2 distances, the same scores IndexFlatL2.search returns
+            distances, positions = faiss.knn(query, vectors[start:stop], min(top_k, stop - start))
+            candidates.extend((float(distance), start + int(position))
+                              for distance, position in zip(distances[0], positions[0]) if position != -1)
+
+        nodes_dict = self.index.index_struct.nodes_dict
+        hits = [(nodes_dict[str(faiss_id)], distance) for distance, faiss_id in heapq.nsmallest(top_k, candidates)]
+        nodes = self.index.docstore.get_nodes([node_id for node_id, _ in hits])
+        return [NodeWithScore(node=node, score=distance) for node, (_, distance) in zip(nodes, hits)]
+
+    def _retrieve(self, query_bundle):
+        search_text = " ".join(query_bundle.embedding_strs)
+        if self.mode == "sparse":
+            return [NodeWithScore(node=node, score=score)
+                    for node, score in self.bm25_index.search(search_text, self.top_k, self.filenames)]
+
+        dense_top_k = self.top_k if self.mode == "dense" else self.candidates
+        dense = self._dense(query_bundle, dense_top_k)
+        if self.mode == "dense":
+            return dense
+
+        sparse = self.bm25_index.search(search_text, self.candidates, self.filenames)
+        fused = defaultdict(float)
+        nodes = {}
+        for rank, result in enumerate(dense):
+            fused[result.node.node_id] += self.alpha / (self.rrf_k + rank + 1)
+            nodes[result.node.node_id] = result.node
+        for rank, (node, _) in enumerate(sparse):
+            fused[node.node_id] += (1 - self.alpha) / (self.rrf_k + rank + 1)
+            nodes.setdefault(node.node_id, node)
+
+        best = heapq.nlargest(self.top_k, fused.items(), key=lambda item: item[1])
+        return [NodeWithScore(node=nodes[node_id], score=score) for node_id, score in best]
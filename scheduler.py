@@ -0,0 +1,262 @@
+"""Process-wide scheduler for LLM and embedding API calls.
+
+Every upstream call goes through the module-level ``scheduler``, which
+
+- takes a token from a per-provider bucket (shared by every session in the
+  process) and a per-API-key bucket before calling out,
+- lets higher-priority work (interactive grading) go before lower-priority
+  work (generation, then background ingestion) waiting on the same provider,
+- retries rate-limit and transient errors with full-jitter exponential backoff,
+- coalesces identical in-flight requests made with the same API key, so one
+  upstream call serves every session waiting on the same result; the shared
+  request runs at the highest priority of the sessions waiting on it.
+
+Streamlit re-executes app.py on every rerun but imports this module once per
+process, so the limits and in-flight table are shared by all sessions.
+"""
+import contextvars
+import hashlib
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import httpx
+import openai
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.embeddings.gemini import GeminiEmbedding
+from llama_index.llms.groq import Groq
+
+INTERACTIVE, GENERATION, BACKGROUND = 0, 1, 2  # Lower values are served first
+
+# (requests per second, burst size)
+PROVIDER_LIMITS = {"groq": (10.0, 20), "gemini": (25.0, 50)}
+KEY_LIMITS = {"groq": (0.5, 5), "gemini": (5.0, 20)}
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5  # Seconds
+BACKOFF_CAP = 30.0
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+_priority = contextvars.ContextVar("llm_priority", default=GENERATION)
+
+
+@contextmanager
+def priority(level):
+    """Run the calls made inside the block at the given priority level."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def request_key(*parts):
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+def error_status(error):
+    for status in (getattr(error, "status_code", None),
+                   getattr(getattr(error, "response", None), "status_code", None),
+                   getattr(error, "code", None)):
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def is_retryable(error):
+    # Groq is called through the OpenAI client, which wraps network failures and
+    # timeouts in APIConnectionError (APITimeoutError subclasses it); no status code
+    if isinstance(error, (TimeoutError, ConnectionError, openai.APIConnectionError, httpx.TransportError)):
+        return True
+    status = error_status(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    message = str(error).lower()
+    return "429" in message or "rate limit" in message or "resource exhausted" in message
+
+
+def backoff_delay(attempt, error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return min(float(headers.get("retry-after")), BACKOFF_CAP)
+    except (TypeError, ValueError):
+        return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, now):
+        """Seconds until a token is available (0 if one is available now)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class Request:
+    """A scheduled call; its level can be raised while it waits for a token."""
+
+    def __init__(self, level):
+        self.level = level
+        self.future = Future()
+
+
+class Scheduler:
+    def __init__(self, provider_limits=PROVIDER_LIMITS, key_limits=KEY_LIMITS):
+        self.provider_limits = provider_limits
+        self.key_limits = key_limits
+        self._condition = threading.Condition()
+        self._buckets = {}
+        self._waiting = {}  # ticket -> (request, provider, key bucket)
+        self._sequence = itertools.count()
+        self._in_flight = {}  # coalesce key -> request
+
+    def _bucket(self, name, limits):
+        if name not in self._buckets:
+            self._buckets[name] = TokenBucket(*limits)
+        return self._buckets[name]
+
+    def _outranked(self, ticket, request, provider, now):
+        # Only a higher-priority waiter that is held up by the shared provider bucket
+        # (its own key bucket has a token) has a claim on the next provider token
+        return any(
+            other.level < request.level and other_provider == provider and key_bucket.wait_time(now) == 0
+            for other_ticket, (other, other_provider, key_bucket) in self._waiting.items()
+            if other_ticket != ticket
+        )
+
+    def acquire(self, provider, key, request):
+        """Block until both the provider and the key bucket can spend a token.
+
+        request.level is re-read on every wake-up, so a waiting request can be
+        promoted by a higher-priority caller coalescing onto it.
+        """
+        ticket = next(self._sequence)
+        with self._condition:
+            provider_bucket = self._bucket(provider, self.provider_limits[provider])
+            key_bucket = self._bucket((provider, key), self.key_limits[provider])
+            self._waiting[ticket] = (request, provider, key_bucket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = max(provider_bucket.wait_time(now), key_bucket.wait_time(now))
+                    if self._outranked(ticket, request, provider, now):
+                        self._condition.wait(timeout=max(wait, 0.05))
+                    elif wait > 0:
+                        self._condition.wait(timeout=wait)
+                    else:
+                        break
+                provider_bucket.take()
+                key_bucket.take()
+            finally:
+                del self._waiting[ticket]
+                self._condition.notify_all()
+
+    def _call_with_retries(self, provider, key, fn, request):
+        for attempt in itertools.count():
+            self.acquire(provider, key, request)
+            try:
+                return fn()
+            except Exception as error:
+                if attempt >= MAX_RETRIES or not is_retryable(error):
+                    raise
+                time.sleep(backoff_delay(attempt, error))
+
+    def call(self, provider, key, fn, coalesce_key=None):
+        """Run fn() under the provider/key rate limits at the current priority.
+
+        Calls sharing a coalesce_key while one is in flight wait for and return
+        that call's result instead of making their own, raising the in-flight
+        call to their priority if it is higher. The coalesce_key must identify
+        the API key as well as the request, so a caller never receives another
+        key's authentication or quota errors.
+        """
+        request = Request(_priority.get())
+        if coalesce_key is None:
+            return self._call_with_retries(provider, key, fn, request)
+
+        with self._condition:
+            leader = self._in_flight.setdefault(coalesce_key, request)
+            if leader is not request:
+                if request.level < leader.level:
+                    leader.level = request.level
+                    self._condition.notify_all()
+
+        if leader is not request:
+            return leader.future.result()
+
+        try:
+            result = self._call_with_retries(provider, key, fn, request)
+        except BaseException as error:
+            request.future.set_exception(error)
+            raise
+        else:
+            request.future.set_result(result)
+            return result
+        finally:
+            with self._condition:
+                del self._in_flight[coalesce_key]
+
+
+scheduler = Scheduler()
+
+
+class ScheduledGroq(Groq):
+    """Groq LLM whose chat and completion calls go through the scheduler."""
+
+    def chat(self, messages, **kwargs):
+        chat = super().chat
+        key = request_key(self.api_key)
+        return scheduler.call(
+            "groq", key,
+            lambda: chat(messages, **kwargs),
+            coalesce_key=request_key(key, "chat", self.model, self.temperature,
+                                     [(m.role, m.content) for m in messages], kwargs),
+        )
+
+    def complete(self, prompt, formatted=False, **kwargs):
+        complete = super().complete
+        key = request_key(self.api_key)
+        return scheduler.call(
+            "groq", key,
+            lambda: complete(prompt, formatted=formatted, **kwargs),
+            coalesce_key=request_key(key, "complete", self.model, self.temperature, prompt, formatted, kwargs),
+        )
+
+
+class ScheduledGeminiEmbedding(GeminiEmbedding):
+    """Gemini embedding model whose API calls go through the scheduler."""
+
+    _key: str = PrivateAttr()
+
+    def __init__(self, api_key=None, **kwargs):
+        super().__init__(api_key=api_key, **kwargs)
+        self._key = request_key(api_key)
+
+    def _scheduled(self, kind, fn, payload):
+        return scheduler.call(
+            "gemini", self._key, fn,
+            coalesce_key=request_key(self._key, kind, self.model_name, payload),
+        )
+
+    def _get_query_embedding(self, query):
+        get = super()._get_query_embedding
+        return self._scheduled("query", lambda: get(query), query)
+
+    def _get_text_embedding(self, text):
+        get = super()._get_text_embedding
+        return self._scheduled("text", lambda: get(text), text)
+
+    def _get_text_embeddings(self, texts):
+        get = super()._get_text_embeddings
+        return self._scheduled("texts", lambda: get(texts), texts)
@@ -0,0 +1,117 @@
+"""Save and restore an assessment session as a single compact file.
+
+A snapshot is a zip archive holding the serialized FAISS index uncompressed
+(vectors do not deflate well) next to a deflated JSON document with the
+docstore, index store, generated assessment and answer state. Restoring
+rebuilds the vector and BM25 indexes locally, without any embedding calls.
+"""
+import io
+import json
+import re
+import zipfile
+import zlib
+
+import faiss
+import numpy as np
+from llama_index.core import StorageContext, load_index_from_storage
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from llama_index.core.storage.index_store import SimpleIndexStore
+from llama_index.vector_stores.faiss import FaissVectorStore
+
+from retrieval import BM25Index, EMBED_DIMENSION, build_document_ids
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_EXTENSION = "tgo"
+INDEX_ENTRY = "index.faiss"
+STATE_ENTRY = "state.json"
+SESSION_KEYS = [
+    "current_page",
+    "current_assessment",
+    "user_answers",
+    "assessment_score",
+    "current_question_index",
+    "assessment_filenames",
+]
+FREE_RESPONSE_ANSWER_KEY = re.compile(r'q\d+$')  # Text area keys on the free response page
+
+
+def export_snapshot(state):
+    """Serialize the session's index and assessment state to snapshot bytes."""
+    index = state["index"]
+    session = {key: state[key] for key in SESSION_KEYS}
+    # JSON object keys are strings; question indexes are turned back into ints on restore
+    session["user_answers"] = {str(i): answer for i, answer in session["user_answers"].items()}
+
+    payload = {
+        "version": SNAPSHOT_VERSION,
+        "docstore": index.docstore.to_dict(),
+        "index_store": index.storage_context.index_store.to_dict(),
+        "session": session,
+        "answers": {key: state[key] for key in state
+                    if isinstance(key, str) and FREE_RESPONSE_ANSWER_KEY.match(key)},
+    }
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        vectors = faiss.serialize_index(index.vector_store.client)
+        archive.writestr(INDEX_ENTRY, vectors.tobytes(), compress_type=zipfile.ZIP_STORED)
+        archive.writestr(STATE_ENTRY, json.dumps(payload, separators=(",", ":")),
+                         compress_type=zipfile.ZIP_DEFLATED)
+    return buffer.getvalue()
+
+
+def check_index(index, dimension):
+    """Raise ValueError unless the FAISS vectors line up with the index and document stores."""
+    client = index.vector_store.client
+    if not isinstance(client, faiss.IndexFlatL2) or client.d != dimension:
+        raise ValueError(f"Expected a {dimension}-dimensional IndexFlatL2")
+    nodes_dict = index.index_struct.nodes_dict
+    # FAISS ids are the positions of the vectors, in insertion order
+    if client.ntotal != len(nodes_dict) or set(nodes_dict) != {str(i) for i in range(client.ntotal)}:
+        raise ValueError("FAISS index does not match the index store")
+    if not all(index.docstore.document_exists(node_id) for node_id in nodes_dict.values()):
+        raise ValueError("Index store refers to chunks missing from the docstore")
+
+
+def restore_snapshot(file, state, dimension=EMBED_DIMENSION):
+    """Rebuild a session from a snapshot file into the given session state.
+
+    Settings.embed_model must already be configured; it is not called.
+    Raises ValueError for any file that is not a complete snapshot of a
+    supported version; the session state is left untouched in that case.
+    """
+    try:
+        with zipfile.ZipFile(file) as archive:
+            payload = json.loads(archive.read(STATE_ENTRY))
+            vectors = np.frombuffer(archive.read(INDEX_ENTRY), dtype=np.uint8)
+    except (zipfile.BadZipFile, zlib.error, EOFError, NotImplementedError, KeyError, ValueError) as error:
+        raise ValueError("Not a session snapshot file") from error
+
+    version = payload.get("version") if isinstance(payload, dict) else None
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version: {version}")
+
+    try:
+        storage_context = StorageContext.from_defaults(
+            docstore=SimpleDocumentStore.from_dict(payload["docstore"]),
+            index_store=SimpleIndexStore.from_dict(payload["index_store"]),
+            vector_store=FaissVectorStore(faiss_index=faiss.deserialize_index(vectors)),
+        )
+        index = load_index_from_storage(storage_context)
+        check_index(index, dimension)
+        bm25_index = BM25Index(index.docstore.docs.values())
+        document_ids = build_document_ids(index)
+
+        # Only known keys are restored, so a snapshot cannot overwrite e.g. the API keys
+        session = {key: payload["session"][key] for key in SESSION_KEYS}
+        session["user_answers"] = {int(i): answer for i, answer in session["user_answers"].items()}
+        answers = {key: value for key, value in payload["answers"].items()
+                   if FREE_RESPONSE_ANSWER_KEY.match(key) and isinstance(value, str)}
+    except (KeyError, TypeError, ValueError, AttributeError, RuntimeError) as error:
+        raise ValueError("Corrupt session snapshot") from error
+
+    state["index"] = index
+    state["bm25_index"] = bm25_index
+    state["document_ids"] = document_ids
+    for key, value in {**session, **answers}.items():
+        state[key] = value
@@ -0,0 +1,89 @@
+import io
+import time
+
+import pymupdf
+
+import app
+
+
+def test_toc_lines_are_detected_by_dot_leaders():
+    assert app.is_toc_line("Introduction ........ 3")
+    assert app.is_toc_line("Chapter 1 . . . . . 7")
+    assert app.is_toc_line("Summary …… 12")
+    assert not app.is_toc_line("The value was 3.5 in 2024")
+    assert not app.is_toc_line("See section 1.2.3.4")
+    assert not app.is_toc_line("Wait... 3")
+
+
+def test_toc_check_is_linear_on_long_dotted_lines():
+    lines = [
+        "." * 8000,
+        ". " * 8000 + "x",
+        "Name: " + ". " * 4000,
+        "…" * 8000 + "x",
+        "1" * 8000 + "x",
+    ]
+    start = time.perf_counter()
+    assert not any(app.is_toc_line(line) for line in lines)
+    assert app.is_toc_line("." * 8000 + " 12")
+    assert time.perf_counter() - start < 0.05
+
+
+def test_split_sections_keeps_heading_stack():
+    lines = ["## Section 1", "one", "## Section 2", "two", "### Detail", "three", "## Section 3", "four"]
+    assert list(app.split_sections(lines)) == [
+        (["Section 1"], "one"),
+        (["Section 2"], "two"),
+        (["Section 2", "Detail"], "three"),
+        (["Section 3"], "four"),
+    ]
+
+
+def test_boilerplate_ignores_short_pages():
+    pages = [f"Example {i}:\nStep 1\nbody {i}" for i in range(5)]
+    assert app.find_boilerplate(pages) == set()
+
+
+def test_boilerplate_drops_running_headers_and_page_numbers():
+    pages = [
+        f"ACME Course Notes\n# Chapter {i}\nfirst {i}\nsecond {i}\nthird {i}\nfourth {i}\nPage {i} of 5"
+        for i in range(5)
+    ]
+    lines = list(app.strip_boilerplate(pages, app.find_boilerplate(pages)))
+    assert "ACME Course Notes" not in lines
+    assert not any(line.startswith("Page ") for line in lines)
+    assert "third 2" in lines
+
+
+def test_boilerplate_keeps_numbered_body_lines_in_margins():
+    pages = [
+        f"Course Handbook\nProblem {i}\nChapter {i} body text line one.\nmiddle {i}\n"
+        f"more {i}\nFourth line {i}.\n- {i} -"
+        for i in range(1, 6)
+    ]
+    lines = list(app.strip_boilerplate(pages, app.find_boilerplate(pages)))
+    assert "Course Handbook" not in lines
+    assert "- 3 -" not in lines
+    for i in range(1, 6):
+        assert f"Problem {i}" in lines
+        assert f"Chapter {i} body text line one." in lines
+        assert f"Fourth line {i}." in lines
+
+
+def test_read_file_keeps_numbered_body_lines_of_pdf():
+    document = pymupdf.open()
+    for i in range(1, 6):
+        page = document.new_page()
+        for y, text in [(40, "ACME Course Notes"), (100, f"Chapter {i} body text line one."),
+                        (130, "The middle of the page stays the same."), (160, f"Third line {i}."),
+                        (190, f"Fourth line {i}."), (800, f"Page {i} of 5")]:
+            page.insert_text((72, y), text)
+    file = io.BytesIO(document.tobytes())
+    file.name = "notes.pdf"
+
+    text = "\n".join(app.read_file(file))
+    assert "ACME Course Notes" not in text
+    assert "Page 3 of 5" not in text
+    for i in range(1, 6):
+        assert f"Chapter {i} body text line one." in text
+        assert f"Fourth line {i}." in text
@@ -0,0 +1,75 @@
+import codecs
+import io
+import time
+import zipfile
+
+import app
+
+
+class Upload(io.BytesIO):
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+
+
+def text_lines(data, **kwargs):
+    return list(app.iter_text_lines(Upload("notes.txt", data), **kwargs))
+
+
+def test_text_encodings_detected():
+    text = "héllo wörld\nline2\fpage2\n" * 3000
+    for encoding in ["utf-8", "utf-8-sig", "utf-16", "utf-32", "cp1252"]:
+        assert text_lines(text.encode(encoding))[:3] == ["héllo wörld", "line2", "page2"]
+
+
+def test_invalid_utf8_falls_back_without_losing_valid_prefix():
+    data = ("ok ü\n" * 20000).encode() + "späte\n".encode("cp1252")
+    lines = text_lines(data)
+    assert set(lines[:-1]) == {"ok ü"}
+    assert lines[-1] == "späte"
+
+
+def test_truncated_trailing_bytes_do_not_raise():
+    assert text_lines(b"Menu: caf\xe9") == ["Menu: café"]
+    assert text_lines(codecs.BOM_UTF16_LE + "abc".encode("utf-16-le") + b"x")[0].startswith("abc")
+
+
+def test_line_breaks_across_block_boundaries():
+    block = app.TEXT_BLOCK_SIZE
+    assert text_lines(b"a" * (block - 1) + b"\r\nb", max_chars=block) == ["a" * (block - 1), "b"]
+    data = ("a" * (block - 3) + "\u2028b").encode()  # 3-byte separator ends the first block
+    assert text_lines(data, max_chars=block) == ["a" * (block - 3), "b"]
+
+
+def test_long_lines_are_split_in_linear_time():
+    words = ("word " * 2_000_000).encode()  # 10 MB without a line break
+    start = time.perf_counter()
+    lines = text_lines(words)
+    assert time.perf_counter() - start < 2
+    assert max(len(line) for line in lines) <= app.SECTION_MAX_CHARS
+    assert "".join(lines) == words.decode()
+
+    lines = text_lines(b"x" * (app.SECTION_MAX_CHARS * 3 + 5) + b"\nnext")
+    assert [len(line) for line in lines] == [app.SECTION_MAX_CHARS] * 3 + [5, 4]
+
+
+def test_empty_file_on_disk(tmp_path):
+    path = tmp_path / "empty.txt"
+    path.write_bytes(b"")
+    with open(path, "rb") as file:
+        assert list(app.iter_text_lines(file)) == []
+
+
+def test_docx_paragraphs_headings_and_tables():
+    w = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+    document = f"""<w:document xmlns:w="{w}"><w:body>
+    <w:p><w:pPr><w:pStyle w:val="Heading1"/></w:pPr><w:r><w:t>Intro</w:t></w:r></w:p>
+    <w:p><w:r><w:t>Hello </w:t></w:r><w:r><w:t>there</w:t></w:r></w:p>
+    <w:tbl><w:tr><w:tc><w:p><w:r><w:t>A</w:t></w:r></w:p></w:tc>
+    <w:tc><w:p><w:r><w:t>B|C</w:t></w:r></w:p></w:tc></w:tr></w:tbl>
+    </w:body></w:document>"""
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("word/document.xml", document)
+    archive.seek(0)
+    assert list(app.iter_docx_lines(archive)) == ["# Intro", "Hello there", "| A | B/C |", ""]
@@ -0,0 +1,103 @@
+import hashlib
+
+import faiss
+import numpy as np
+from llama_index.core import QueryBundle, Settings, StorageContext, VectorStoreIndex
+from llama_index.core.embeddings import BaseEmbedding, MockEmbedding
+from llama_index.core.schema import TextNode
+from llama_index.vector_stores.faiss import FaissVectorStore
+
+from retrieval import BM25Index, HybridRetriever, build_document_ids
+
+NODES = [
+    TextNode(text="Photosynthesis converts light energy in chloroplasts.", metadata={"filename": "bio.txt"}),
+    TextNode(text="Mitochondria produce ATP through respiration.", metadata={"filename": "bio.txt"}),
+    TextNode(text="Answer each question and mark the correct option.", metadata={"filename": "rules.txt"}),
+]
+
+
+def test_bm25_ranks_matching_chunk_first():
+    index = BM25Index(NODES)
+    assert index.search("ATP respiration", 1)[0][0] is NODES[1]
+    assert index.search("unknownword") == []
+
+
+def test_bm25_filters_by_filename():
+    index = BM25Index(NODES)
+    results = index.search("question correct photosynthesis", 3, filenames=["bio.txt"])
+    assert [node for node, _ in results] == [NODES[0]]
+
+
+def test_sparse_retrieval_uses_search_text_not_prompt():
+    retriever = HybridRetriever(None, BM25Index(NODES), mode="sparse", top_k=1)
+    bundle = QueryBundle(
+        query_str="Generate a multiple choice question. Correct Answer: [a/b/c/d]",
+        custom_embedding_strs=["photosynthesis"],
+    )
+    assert retriever.retrieve(bundle)[0].node is NODES[0]
+
+
+
+class HashEmbedding(BaseEmbedding):
+    """Deterministic pseudo-random vectors, so dense rankings differ between chunks."""
+
+    def _embed(self, text):
+        seed = int(hashlib.sha256(text.encode()).hexdigest()[:16], 16)
+        return np.random.default_rng(seed).standard_normal(16).tolist()
+
+    def _get_query_embedding(self, query):
+        return self._embed(query)
+
+    def _get_text_embedding(self, text):
+        return self._embed(text)
+
+    async def _aget_query_embedding(self, query):
+        return self._embed(query)
+
+
+def build_index(nodes):
+    vector_store = FaissVectorStore(faiss_index=faiss.IndexFlatL2(16))
+    return VectorStoreIndex(nodes, storage_context=StorageContext.from_defaults(vector_store=vector_store))
+
+
+def test_scoped_dense_search_matches_id_selector_search():
+    Settings.embed_model = HashEmbedding()
+    # Interleaved documents, so the selected ids are not one contiguous range
+    nodes = [TextNode(text=f"Chunk {i}", metadata={"filename": f"doc{i % 3}.txt"}) for i in range(60)]
+    index = build_index(nodes)
+    document_ids = build_document_ids(index)
+    filenames = ["doc0.txt", "doc2.txt"]
+    retriever = HybridRetriever(index, BM25Index(nodes), mode="dense", top_k=5,
+                                document_ids=document_ids, filenames=filenames)
+
+    for query in ["cells", "energy", "transport"]:
+        selected = np.concatenate([document_ids[name] for name in filenames])
+        params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(selected))
+        embedding = np.array([Settings.embed_model.get_query_embedding(query)], dtype=np.float32)
+        _, expected = index.vector_store.client.search(embedding, 5, params=params)
+
+        nodes_dict = index.index_struct.nodes_dict
+        assert [result.node.node_id for result in retriever.retrieve(query)] == \
+            [nodes_dict[str(faiss_id)] for faiss_id in expected[0]]
+
+
+def test_scoped_search_of_unknown_document_is_empty():
+    Settings.embed_model = HashEmbedding()
+    index = build_index(NODES)
+    retriever = HybridRetriever(index, BM25Index(NODES), mode="dense", top_k=3,
+                                document_ids=build_document_ids(index), filenames=["missing.txt"])
+    assert retriever.retrieve("energy") == []
+
+
+def test_scoped_search_embeds_with_the_index_model():
+    own_model = HashEmbedding()
+    Settings.embed_model = own_model
+    index = build_index(NODES)
+    # Another session configuring its models replaces the process-wide Settings
+    Settings.embed_model = MockEmbedding(embed_dim=16)
+
+    retriever = HybridRetriever(index, BM25Index(NODES), mode="dense", top_k=3,
+                                document_ids=build_document_ids(index), filenames=["bio.txt"])
+    bundle = QueryBundle("energy")
+    retriever.retrieve(bundle)
+    assert bundle.embedding == own_model.get_query_embedding("energy")
@@ -0,0 +1,118 @@
+import threading
+import time
+
+import httpx
+import openai
+
+from scheduler import BACKGROUND, GENERATION, INTERACTIVE, Request, Scheduler, is_retryable, priority
+
+LIMITS = {"test": (1000.0, 100)}
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_identical_calls_are_coalesced():
+    scheduler = Scheduler(LIMITS, LIMITS)
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait()
+        return "result"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(scheduler.call("test", "k", fn, "same")))
+               for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: len(calls) == 1)
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert calls == [1]
+    assert results == ["result"] * 3
+
+
+def test_errors_are_only_shared_with_callers_of_the_same_key():
+    scheduler = Scheduler(LIMITS, LIMITS)
+    release = threading.Event()
+
+    def failing():
+        release.wait()
+        raise PermissionError("invalid api key")
+
+    errors = []
+
+    def leader():
+        try:
+            scheduler.call("test", "bad", failing, coalesce_key=("bad", "prompt"))
+        except PermissionError as error:
+            errors.append(error)
+
+    thread = threading.Thread(target=leader)
+    thread.start()
+    wait_for(lambda: scheduler._in_flight)
+    # Same request under another key gets its own call instead of the leader's error
+    assert scheduler.call("test", "good", lambda: "ok", coalesce_key=("good", "prompt")) == "ok"
+    release.set()
+    thread.join()
+    assert len(errors) == 1
+
+
+def test_follower_raises_priority_of_in_flight_request():
+    # Without the promotion the GENERATION call would take the next token first
+    # One provider token per second, already spent: every caller has to wait for the next one
+    scheduler = Scheduler({"test": (1.0, 1)}, LIMITS)
+    scheduler.acquire("test", "k", Request(INTERACTIVE))
+    order = []
+
+    def call(level, coalesce_key, name):
+        with priority(level):
+            scheduler.call("test", "k", lambda: order.append(name), coalesce_key)
+
+    background = threading.Thread(target=call, args=(BACKGROUND, "shared", "shared"))
+    background.start()
+    wait_for(lambda: len(scheduler._waiting) == 1)
+    other = threading.Thread(target=call, args=(GENERATION, "other", "other"))
+    other.start()
+    wait_for(lambda: len(scheduler._waiting) == 2)
+
+    follower = threading.Thread(target=call, args=(INTERACTIVE, "shared", "follower"))
+    follower.start()
+    wait_for(lambda: scheduler._in_flight["shared"].level == INTERACTIVE)
+    for thread in (background, other, follower):
+        thread.join()
+    assert order == ["shared", "other"]
+
+
+
+def test_connection_errors_and_timeouts_are_retryable():
+    request = httpx.Request("POST", "https://api.groq.com/openai/v1/chat/completions")
+    assert is_retryable(openai.APIConnectionError(request=request))
+    assert is_retryable(openai.APITimeoutError(request=request))
+    assert is_retryable(httpx.ConnectError("connection refused", request=request))
+    assert is_retryable(TimeoutError())
+    assert not is_retryable(ValueError("bad prompt"))
+
+
+def test_transient_connection_error_is_retried(monkeypatch):
+    monkeypatch.setattr("scheduler.backoff_delay", lambda attempt, error: 0)
+    scheduler = Scheduler(LIMITS, LIMITS)
+    request = httpx.Request("POST", "https://api.groq.com/openai/v1/chat/completions")
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise openai.APITimeoutError(request=request)
+        return "ok"
+
+    assert scheduler.call("test", "k", flaky) == "ok"
+    assert len(attempts) == 3
@@ -0,0 +1,121 @@
+import io
+import json
+import time
+import zipfile
+
+import faiss
+import numpy as np
+import pytest
+from llama_index.core import Settings, StorageContext, VectorStoreIndex
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.schema import TextNode
+from llama_index.vector_stores.faiss import FaissVectorStore
+
+from snapshot import INDEX_ENTRY, STATE_ENTRY, export_snapshot, restore_snapshot
+
+EMBED_DIM = 8
+
+
+@pytest.fixture
+def state():
+    Settings.embed_model = MockEmbedding(embed_dim=EMBED_DIM)
+    nodes = [
+        TextNode(text=f"Chunk {i} about topic {i % 7}.", metadata={"filename": f"doc{i % 3}.txt"})
+        for i in range(2000)
+    ]
+    vector_store = FaissVectorStore(faiss_index=faiss.IndexFlatL2(EMBED_DIM))
+    index = VectorStoreIndex(nodes, storage_context=StorageContext.from_defaults(vector_store=vector_store))
+    return {
+        "index": index,
+        "current_page": "free_response",
+        "current_assessment": "1. Explain topic 3.",
+        "user_answers": {0: "b"},
+        "assessment_score": None,
+        "current_question_index": 1,
+        "assessment_filenames": ["doc1.txt"],
+        "q0": "Draft answer",
+    }
+
+
+def rewrite(data, entry, content):
+    """Return a copy of the snapshot bytes with one archive entry replaced."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(data)) as source, zipfile.ZipFile(buffer, "w") as target:
+        for name in source.namelist():
+            if name != entry:
+                target.writestr(name, source.read(name))
+        if content is not None:
+            target.writestr(entry, content)
+    return buffer.getvalue()
+
+
+def without(data, *path):
+    payload = json.loads(zipfile.ZipFile(io.BytesIO(data)).read(STATE_ENTRY))
+    parent = payload
+    for key in path[:-1]:
+        parent = parent[key]
+    del parent[path[-1]]
+    return rewrite(data, STATE_ENTRY, json.dumps(payload))
+
+
+def vectors(index):
+    return faiss.serialize_index(index).tobytes()
+
+
+def flat_index(count, dimension=EMBED_DIM, metric=faiss.IndexFlatL2):
+    index = metric(dimension)
+    index.add(np.random.default_rng(0).standard_normal((count, dimension)).astype(np.float32))
+    return index
+
+
+def edit_state(data, edit):
+    payload = json.loads(zipfile.ZipFile(io.BytesIO(data)).read(STATE_ENTRY))
+    edit(payload)
+    return rewrite(data, STATE_ENTRY, json.dumps(payload))
+
+
+def drop_first_chunk(payload):
+    docs = payload["docstore"]["docstore/data"]
+    del docs[next(iter(docs))]
+
+
+def test_restore_round_trip_is_fast(state):
+    data = export_snapshot(state)
+    restored = {}
+    start = time.perf_counter()
+    restore_snapshot(io.BytesIO(data), restored, dimension=EMBED_DIM)
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < 1.0
+    assert restored["index"].vector_store.client.ntotal == 2000
+    assert restored["user_answers"] == {0: "b"}
+    assert restored["q0"] == "Draft answer"
+    assert len(restored["document_ids"]["doc1.txt"]) == 667
+
+
+@pytest.mark.parametrize("corrupt", [
+    lambda data: b"not a zip file",
+    lambda data: data[:len(data) // 2],
+    lambda data: rewrite(data, STATE_ENTRY, None),
+    lambda data: rewrite(data, INDEX_ENTRY, None),
+    lambda data: rewrite(data, STATE_ENTRY, "{truncated"),
+    lambda data: rewrite(data, STATE_ENTRY, "[1, 2]"),
+    lambda data: rewrite(data, STATE_ENTRY, json.dumps({"version": 99})),
+    lambda data: rewrite(data, STATE_ENTRY, json.dumps({"version": 1})),
+    lambda data: rewrite(data, INDEX_ENTRY, b"garbage vectors"),
+    lambda data: without(data, "docstore"),
+    lambda data: without(data, "session"),
+    lambda data: without(data, "session", "user_answers"),
+    lambda data: without(data, "answers"),
+    # FAISS vectors that do not line up with the index and document stores
+    lambda data: rewrite(data, INDEX_ENTRY, vectors(flat_index(4000))),
+    lambda data: rewrite(data, INDEX_ENTRY, vectors(flat_index(1000))),
+    lambda data: rewrite(data, INDEX_ENTRY, vectors(flat_index(2000, dimension=EMBED_DIM * 2))),
+    lambda data: rewrite(data, INDEX_ENTRY, vectors(flat_index(2000, metric=faiss.IndexFlatIP))),
+    lambda data: edit_state(data, drop_first_chunk),
+])
+def test_malformed_snapshot_raises_value_error(state, corrupt):
+    restored = {}
+    with pytest.raises(ValueError):
+        restore_snapshot(io.BytesIO(corrupt(export_snapshot(state))), restored, dimension=EMBED_DIM)
+    assert restored == {}